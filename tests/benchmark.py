@@ -0,0 +1,613 @@
+#!/usr/bin/env python3
+#
+# benchmark.py -- Performance benchmarks for dtrx.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+
+# Generates a corpus of synthetic archives, then times how dtrx handles
+# each one: detecting its type (ExtractorBuilder.get_extractor), extracting
+# it (extract), organizing the results (each handler's handle), and listing
+# it (ListAction), all in this process, plus a whole dtrx run in a new one.
+# Each number is the best of --repeat runs.  Results can be saved as a
+# baseline with --save, and compared against one with --baseline, which
+# exits with status 1 if anything got slower than --tolerance allows.
+#
+#   python3 tests/benchmark.py --save baseline.json
+#   (change dtrx)
+#   python3 tests/benchmark.py --baseline baseline.json
+
+import argparse
+import bz2
+import contextlib
+import gzip
+import importlib.machinery
+import importlib.util
+import io
+import json
+import lzma
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+DTRX_SCRIPT = Path(__file__).absolute().parent.parent / "scripts" / "dtrx"
+
+# Bump this when the corpus changes, so old corpora and baselines aren't
+# compared with new ones.
+CORPUS_VERSION = 1
+
+WORDS = (
+    b"archive extract member directory file header block stream tar zip "
+    b"gzip bzip2 xz zstd cpio deb rpm gem permission owner group link "
+    b"target manifest handler policy decoder pipe process thread"
+).split()
+
+
+def scaled(count, scale):
+    return max(1, int(count * scale))
+
+
+def text(rng, size):
+    # Compressible, like most of what people archive.
+    data = bytearray()
+    while len(data) < size:
+        data += rng.choice(WORDS) + b" "
+    return bytes(data[:size])
+
+
+def write_file(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+# Each workload builds a tree under root.  All but bomb put everything in
+# one directory named after the workload, so the archive's name matches it.
+
+
+def build_tiny_files(root, scale, rng):
+    # Lots of small files over a few directories, like a source tree.
+    top = root / "tiny-files"
+    for index in range(scaled(2000, scale)):
+        path = top / "dir{:02d}".format(index % 40) / "file{:05d}.txt".format(index)
+        write_file(path, text(rng, rng.randrange(16, 1024)))
+
+
+def build_huge_file(root, scale, rng):
+    # One big file, half text and half noise.
+    size = scaled(32 * 1024 * 1024, scale)
+    pool = text(rng, 1024 * 1024)
+    block_size = 64 * 1024
+    path = root / "huge-file" / "huge-file.bin"
+    path.parent.mkdir(parents=True)
+    with path.open("wb") as output:
+        for offset in range(0, size, block_size):
+            count = min(block_size, size - offset)
+            if (offset // block_size) % 2:
+                output.write(rng.getrandbits(8 * count).to_bytes(count, "little"))
+            else:
+                start = rng.randrange(len(pool) - count)
+                output.write(pool[start : start + count])
+
+
+def build_deep_tree(root, scale, rng):
+    # Directories nested inside each other, each with one file.  The depth
+    # is capped to keep paths well under PATH_MAX.
+    path = root / "deep-tree"
+    for level in range(min(scaled(100, scale), 600)):
+        path = path / "{:02d}".format(level % 100)
+        write_file(path / "file.txt", text(rng, 64))
+
+
+def build_wide_dir(root, scale, rng):
+    # One directory with many entries in it.
+    top = root / "wide-dir"
+    for index in range(scaled(5000, scale)):
+        write_file(top / "entry{:06d}".format(index), text(rng, 32))
+
+
+def build_nested(root, scale, rng):
+    # Archives inside an archive, for dtrx -r.
+    top = root / "nested"
+    top.mkdir()
+    for index in range(scaled(10, scale)):
+        inner_path = top / "inner{:03d}.tar.gz".format(index)
+        with tarfile.open(str(inner_path), "w:gz") as inner:
+            for member in range(scaled(50, scale)):
+                data = text(rng, rng.randrange(16, 1024))
+                info = tarfile.TarInfo("inner{:03d}/file{:03d}".format(index, member))
+                info.size = len(data)
+                info.mtime = 0
+                inner.addfile(info, io.BytesIO(data))
+
+
+def build_bomb(root, scale, rng):
+    # Everything at the top level, with no directory around it.
+    for index in range(scaled(500, scale)):
+        write_file(root / "loose{:04d}.txt".format(index), text(rng, 256))
+
+
+WORKLOADS = {
+    "tiny-files": build_tiny_files,
+    "huge-file": build_huge_file,
+    "deep-tree": build_deep_tree,
+    "wide-dir": build_wide_dir,
+    "nested": build_nested,
+    "bomb": build_bomb,
+}
+
+
+def tree_names(root):
+    return sorted(path.name for path in root.iterdir())
+
+
+def make_tar(compression):
+    def make(root, output):
+        with tarfile.open(str(output), "w:" + compression) as archive:
+            for name in tree_names(root):
+                archive.add(str(root / name), name)
+
+    return make
+
+
+def make_zip(root, output):
+    with zipfile.ZipFile(str(output), "w", zipfile.ZIP_DEFLATED) as archive:
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(dirnames) + sorted(filenames):
+                path = Path(directory, name)
+                archive.write(str(path), str(path.relative_to(root)))
+
+
+def make_command(*command, tar_first=False):
+    # Builds the archive with an external tool, run from inside root.
+    def make(root, output):
+        names = tree_names(root)
+        if tar_first:
+            make_tar("")(root, output.with_suffix(""))
+            subprocess.run(list(command) + [str(output.with_suffix(""))], check=True)
+            return
+        if command[0] == "cpio":
+            listing = subprocess.run(
+                ["find"] + names, cwd=str(root), check=True, stdout=subprocess.PIPE
+            ).stdout
+            with output.open("wb") as archive:
+                subprocess.run(
+                    command, cwd=str(root), input=listing, stdout=archive, check=True
+                )
+            return
+        subprocess.run(
+            list(command) + [str(output)] + names,
+            cwd=str(root),
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+    return make
+
+
+def make_compressed(opener):
+    # A single compressed file; only for workloads that are one file.
+    def make(root, output):
+        (source,) = [path for path in root.rglob("*") if path.is_file()]
+        with source.open("rb") as data, opener(str(output), "wb") as compressed:
+            shutil.copyfileobj(data, compressed, 1024 * 1024)
+
+    return make
+
+
+# name: (extension, builder, tool it needs, single files only)
+FORMATS = {
+    "tar": ("tar", make_tar(""), None, False),
+    "tar.gz": ("tar.gz", make_tar("gz"), None, False),
+    "tar.bz2": ("tar.bz2", make_tar("bz2"), None, False),
+    "tar.xz": ("tar.xz", make_tar("xz"), None, False),
+    "tar.zst": (
+        "tar.zst",
+        make_command("zstd", "-q", "--rm", tar_first=True),
+        "zstd",
+        False,
+    ),
+    "zip": ("zip", make_zip, None, False),
+    "7z": ("7z", make_command("7z", "a", "-bd", "-y"), "7z", False),
+    "cpio": (
+        "cpio",
+        make_command("cpio", "-o", "-H", "newc", "--quiet"),
+        "cpio",
+        False,
+    ),
+    "gz": ("gz", make_compressed(gzip.open), None, True),
+    "bz2": ("bz2", make_compressed(bz2.open), None, True),
+    "xz": ("xz", make_compressed(lzma.open), None, True),
+}
+
+SINGLE_FILE_WORKLOADS = {"huge-file"}
+
+# name: (dtrx options, whether the output should already be there)
+MODES = {
+    "default": ([], False),
+    "flat": (["--flat"], False),
+    "overwrite": (["--overwrite"], True),
+    "update": (["--update"], True),
+    "list": (["--list"], False),
+}
+
+
+class Corpus:
+    # The generated archives, kept in a directory with a corpus.json that
+    # says how they were made.  Archives that are already there are reused
+    # when that matches, and replaced when it doesn't.  A directory with
+    # other files in it and no corpus.json isn't used at all, and only
+    # files the benchmark makes are ever removed.
+    def __init__(self, directory, scale, seed):
+        self.directory = Path(directory)
+        self.settings = {"version": CORPUS_VERSION, "scale": scale, "seed": seed}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        settings_path = self.directory / "corpus.json"
+        if not settings_path.exists():
+            if any(self.directory.iterdir()):
+                raise BenchmarkError(
+                    "{} isn't empty, and isn't a corpus".format(self.directory)
+                )
+        else:
+            try:
+                current = json.loads(settings_path.read_text())
+            except (OSError, ValueError):
+                current = None
+            if current == self.settings:
+                return
+            self.remove_archives()
+        settings_path.write_text(json.dumps(self.settings))
+
+    def remove_archives(self):
+        for workload in WORKLOADS:
+            for extension, _, _, _ in FORMATS.values():
+                path = self.directory / "{}.{}".format(workload, extension)
+                if path.exists():
+                    path.unlink()
+        self.remove_trees()
+
+    def archive(self, workload, format_name):
+        extension, make, _, _ = FORMATS[format_name]
+        path = self.directory / "{}.{}".format(workload, extension)
+        if not path.exists():
+            root = self.tree(workload)
+            print("generating {}".format(path.name), file=sys.stderr)
+            make(root, path)
+        return path
+
+    def tree(self, workload):
+        root = self.directory / ".trees" / workload
+        if not root.exists():
+            staging = root.with_name(root.name + ".tmp")
+            shutil.rmtree(str(staging), ignore_errors=True)
+            staging.mkdir(parents=True)
+            seed = "{}:{}".format(self.settings["seed"], workload)
+            WORKLOADS[workload](staging, self.settings["scale"], random.Random(seed))
+            staging.rename(str(root))
+        return root
+
+    def remove_trees(self):
+        shutil.rmtree(str(self.directory / ".trees"), ignore_errors=True)
+
+
+def load_dtrx():
+    loader = importlib.machinery.SourceFileLoader("dtrx", str(DTRX_SCRIPT))
+    spec = importlib.util.spec_from_loader("dtrx", loader)
+    dtrx = importlib.util.module_from_spec(spec)
+    loader.exec_module(dtrx)
+    return dtrx
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class Runner:
+    def __init__(self, dtrx, work_dir):
+        self.dtrx = dtrx
+        self.work_dir = work_dir
+        self.options = {}
+
+    def get_options(self, mode):
+        # Quiet, so only what the actions write to stdout is left, and that
+        # goes to /dev/null.  --wait-cleanup keeps background rm processes
+        # from competing with the next run.
+        if mode not in self.options:
+            arguments = ["-n", "-qq", "--wait-cleanup"] + MODES[mode][0]
+            application = self.dtrx.ExtractorApplication(arguments + ["archive"])
+            self.options[mode] = application.options
+        return self.options[mode]
+
+    @contextlib.contextmanager
+    def directory(self, archive, mode):
+        path = Path(tempfile.mkdtemp(prefix="run-", dir=self.work_dir))
+        try:
+            if MODES[mode][1]:
+                self.run_dtrx(archive, path, [])
+            yield path
+        finally:
+            self.dtrx.TreeRemover.wait()
+            shutil.rmtree(str(path))
+
+    def run_dtrx(self, archive, directory, options):
+        result = subprocess.run(
+            [sys.executable, str(DTRX_SCRIPT), "-n", "--wait-cleanup"]
+            + options
+            + [str(archive)],
+            cwd=str(directory),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        if result.returncode != 0:
+            raise BenchmarkError(
+                "dtrx {} failed:\n{}".format(archive.name, result.stderr)
+            )
+
+    def time_cli(self, archive, mode, recursive):
+        options = list(MODES[mode][0])
+        if recursive:
+            options.append("-r")
+        with self.directory(archive, mode) as directory:
+            started = time.perf_counter()
+            self.run_dtrx(archive, directory, options)
+            return {"cli": time.perf_counter() - started}
+
+    def time_extraction(self, archive, mode):
+        # The same steps as ExtractionAction.run, timed one at a time.
+        dtrx = self.dtrx
+        options = self.get_options(mode)
+        timings = {"detection": 0.0, "extract": 0.0}
+        with self.directory(archive, mode) as directory:
+            builder = dtrx.ExtractorBuilder(str(archive), options, str(directory))
+            candidates = builder.get_extractor()
+            action = dtrx.ExtractionAction(options, [archive.name])
+            action.current_filename = archive.name
+            while True:
+                started = time.perf_counter()
+                extractor = next(candidates, None)
+                timings["detection"] += time.perf_counter() - started
+                if extractor is None:
+                    raise BenchmarkError(
+                        "no extractor could handle {}".format(archive.name)
+                    )
+                started = time.perf_counter()
+                error = action.report(extractor.extract)
+                timings["extract"] += time.perf_counter() - started
+                stderr = extractor.get_stderr()
+                if not error:
+                    break
+                dtrx.TreeRemover.wait()
+            error = action.report(action.get_handler, extractor)
+            if error:
+                raise BenchmarkError("{}: {}".format(archive.name, error))
+            handler = action.current_handler
+            started = time.perf_counter()
+            error = action.report(handler.handle)
+            timings["handler:" + type(handler).__name__] = time.perf_counter() - started
+            if error:
+                raise BenchmarkError(
+                    "{}: {}\n{}".format(
+                        archive.name, error, stderr.decode(errors="replace")
+                    )
+                )
+        return timings
+
+    def time_listing(self, archive):
+        # ListAction from start to end, detection included.
+        dtrx = self.dtrx
+        options = self.get_options("list")
+        builder = dtrx.ExtractorBuilder(str(archive), options, self.work_dir)
+        action = dtrx.ListAction(options, [archive.name])
+        real_stdout = sys.stdout
+        with open(os.devnull, "w") as devnull:
+            sys.stdout = devnull
+            started = time.perf_counter()
+            try:
+                for extractor in builder.get_extractor():
+                    error = action.run(archive.name, extractor)
+                    extractor.get_stderr()
+                    if not error:
+                        break
+                else:
+                    raise BenchmarkError(
+                        "no lister could handle {}".format(archive.name)
+                    )
+            finally:
+                sys.stdout = real_stdout
+        return {"list": time.perf_counter() - started}
+
+    def measure(self, archive, workload, mode, repeat):
+        best = {}
+        for _ in range(repeat):
+            if mode == "list":
+                timings = self.time_listing(archive)
+            else:
+                timings = self.time_extraction(archive, mode)
+            timings.update(self.time_cli(archive, mode, workload == "nested"))
+            for stage, seconds in timings.items():
+                best[stage] = min(seconds, best.get(stage, seconds))
+        return best
+
+
+def host_info():
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance, min_delta):
+    # Returns the lines to show for each result and how many regressed.
+    regressions = 0
+    lines = []
+    for key in sorted(results):
+        for stage, seconds in sorted(results[key].items()):
+            line = "{:<32} {:<28} {:9.4f}s".format(key, stage, seconds)
+            previous = baseline.get(key, {}).get(stage)
+            if previous is not None:
+                change = (seconds - previous) / previous if previous else 0.0
+                line += " {:9.4f}s {:+7.1%}".format(previous, change)
+                if (seconds > previous * (1 + tolerance)) and (
+                    seconds - previous > min_delta
+                ):
+                    line += "  REGRESSION"
+                    regressions += 1
+            lines.append(line)
+    return lines, regressions
+
+
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(
+        description="Time dtrx on a generated corpus of archives."
+    )
+    parser.add_argument(
+        "--workload",
+        action="append",
+        choices=sorted(WORKLOADS),
+        help="only run this workload; may be repeated",
+    )
+    parser.add_argument(
+        "--format",
+        action="append",
+        choices=sorted(FORMATS),
+        help="only use this archive format; may be repeated",
+    )
+    parser.add_argument(
+        "--mode",
+        action="append",
+        choices=sorted(MODES),
+        help="only run dtrx this way; may be repeated",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiply the size of every workload by SCALE (default: 1)",
+    )
+    parser.add_argument("--seed", default="dtrx", help="seed for the generated corpus")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="run each benchmark N times and keep the best (default: 3)",
+    )
+    parser.add_argument(
+        "--corpus",
+        help="keep the generated corpus in DIR and reuse it on later runs",
+    )
+    parser.add_argument("--save", metavar="FILE", help="save the results to FILE")
+    parser.add_argument(
+        "--baseline", metavar="FILE", help="compare the results with FILE"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="how much slower than the baseline is a regression (default: 0.25)",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.005,
+        help="ignore changes smaller than this many seconds (default: 0.005)",
+    )
+    options = parser.parse_args(arguments)
+    if options.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    elif options.scale <= 0:
+        parser.error("--scale must be positive")
+    return options
+
+
+def main(arguments):
+    options = parse_arguments(arguments)
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            saved = json.load(baseline_file)
+        if saved.get("corpus") != {
+            "version": CORPUS_VERSION,
+            "scale": options.scale,
+            "seed": options.seed,
+        }:
+            sys.exit("ERROR: the baseline was made from a different corpus")
+        if saved.get("host") != host_info():
+            print("warning: the baseline was made on a different host", file=sys.stderr)
+        baseline = saved["results"]
+
+    dtrx = load_dtrx()
+    work_dir = tempfile.mkdtemp(prefix="dtrx-benchmark-")
+    results = {}
+    try:
+        corpus = Corpus(
+            options.corpus or os.path.join(work_dir, "corpus"),
+            options.scale,
+            options.seed,
+        )
+        runner = Runner(dtrx, work_dir)
+        for workload in options.workload or WORKLOADS:
+            for format_name in options.format or FORMATS:
+                _, _, tool, single_file = FORMATS[format_name]
+                if single_file and (workload not in SINGLE_FILE_WORKLOADS):
+                    continue
+                elif tool and not shutil.which(tool):
+                    print(
+                        "skipping {}: {} is not installed".format(format_name, tool),
+                        file=sys.stderr,
+                    )
+                    continue
+                archive = corpus.archive(workload, format_name)
+                for mode in options.mode or MODES:
+                    key = "{}/{}/{}".format(workload, format_name, mode)
+                    print("running {}".format(key), file=sys.stderr)
+                    results[key] = runner.measure(
+                        archive, workload, mode, options.repeat
+                    )
+        corpus.remove_trees()
+    except BenchmarkError as error:
+        sys.exit("ERROR: {}".format(error))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    lines, regressions = compare(
+        results, baseline, options.tolerance, options.min_delta
+    )
+    print("\n".join(lines))
+    if options.save:
+        with open(options.save, "w") as save_file:
+            json.dump(
+                {"corpus": corpus.settings, "host": host_info(), "results": results},
+                save_file,
+                indent=1,
+                sort_keys=True,
+            )
+            save_file.write("\n")
+    if regressions:
+        print("{} regression(s) from {}".format(regressions, options.baseline))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))